@@ -0,0 +1,13 @@
+import os
+from numba.pycc import CC
+from risk_kernels import _risk
+
+# ── AOT Build ────────────────────────────────────────────────────────────────
+# `python _risk_aot.py` writes the risk_aot extension next to the app, which
+# risk_kernels imports in place of the JIT kernel (no compile at startup).
+cc = CC("risk_aot")
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+cc.export("risk10", "f8(f8,i4,f8,f8,f8,i4,i4,f8,f8,i4)")(_risk)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -0,0 +1,27 @@
+from types import MappingProxyType
+
+# ── Session State Defaults ───────────────────────────────────────────────────
+# Wizard constants live outside the Streamlit script so they are built once
+# per process rather than on every rerun.
+DEFAULTS = MappingProxyType({
+    'age':60, 'sex':'Male', 'weight':75.0, 'height':170.0,
+    'smoker':False, 'diabetes':False, 'egfr':90,
+    'tc':5.2, 'hdl':1.3, 'ldl0':3.0, 'crp':2.5,
+    'hba1c':7.0, 'tg':1.2,
+    'pre_stat':'None','pre_ez':False,'pre_bemp':False,
+    'new_stat':'None','new_ez':False,'new_bemp':False,
+    'pcsk9':False,'inclisiran':False,
+    'sbp':140
+})
+
+# ── Evidence Mapping ─────────────────────────────────────────────────────────
+TRIALS = MappingProxyType({
+    "Atorvastatin 80 mg": ("CTT meta-analysis", "https://pubmed.ncbi.nlm.nih.gov/20167315/"),
+    "Rosuvastatin 20 mg": ("CTT meta-analysis", "https://pubmed.ncbi.nlm.nih.gov/20167315/"),
+    "Ezetimibe 10 mg":     ("IMPROVE-IT",         "https://pubmed.ncbi.nlm.nih.gov/26405142/"),
+    "Bempedoic acid":      ("CLEAR Outcomes",     "https://pubmed.ncbi.nlm.nih.gov/35338941/"),
+    "PCSK9 inhibitor":     ("FOURIER",            "https://pubmed.ncbi.nlm.nih.gov/28436927/"),
+    "Inclisiran":          ("ORION-10",           "https://pubmed.ncbi.nlm.nih.gov/32302303/"),
+    "Icosapent ethyl":     ("REDUCE-IT",          "https://pubmed.ncbi.nlm.nih.gov/31141850/"),
+    "Semaglutide":         ("STEP",               "https://pubmed.ncbi.nlm.nih.gov/34499685/")
+})
@@ -1,19 +1,36 @@
 import streamlit as st
 import os
-import math
-import pandas as pd
-import plotly.graph_objects as go
 from io import BytesIO
-from docx import Document
 import logging
+from logging.handlers import MemoryHandler
+from app_constants import DEFAULTS, TRIALS
+from risk_kernels import (risk_kernel, five_year_kernel, lifetime_kernel,
+                          STATINS, therapy_mask, calculate_ldl_projection)
 
 # ── Setup Logging for Analytics ─────────────────────────────────────────────
-logging.basicConfig(filename='analytics.log', level=logging.INFO,
-                    format='%(asctime)s - %(message)s')
+# Buffer navigation records and write them in batches; attached once per
+# process since Streamlit re-executes this script on every rerun. The handler
+# check keeps it single even if the resource cache is cleared.
+@st.cache_resource
+def _analytics_handler():
+    root = logging.getLogger()
+    path = os.path.abspath('analytics.log')
+    for h in root.handlers:
+        if isinstance(h, MemoryHandler) and getattr(h.target, 'baseFilename', None) == path:
+            return h
+    fh = logging.FileHandler(path)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    mh = MemoryHandler(capacity=64, flushLevel=logging.WARNING, target=fh)
+    root.setLevel(logging.INFO)
+    root.addHandler(mh)
+    return mh
+
+_analytics_handler()
 
 # ── Page Configuration & CSS ────────────────────────────────────────────────
 st.set_page_config(layout="wide", page_title="SMART CVD Risk Reduction")
-st.markdown("""
+
+_CSS = """
 <style>
 .header { position: sticky; top: 0; background:#f7f7f7; padding:5px 10px; display:flex; justify-content:flex-end; z-index:100;}
 .progress { display:flex; justify-content:center; margin:10px 0; }
@@ -21,18 +38,36 @@ st.markdown("""
 .progress .current { background:#3498db; color:#fff; }
 .card { background:#fff; padding:15px; margin:15px 0; border-radius:8px; box-shadow:0 1px 3px rgba(0,0,0,0.1); }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+_FOOTER = "\n\n".join([
+    "---",
+    "Created by Samuel Panday — 21/04/2025",
+    "PRIME team, King's College Hospital",
+    "For informational purposes; not a substitute for clinical advice.",
+])
+
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # ── Header with Logo ─────────────────────────────────────────────────────────
+@st.cache_resource
+def _logo():
+    p = "logo.png"
+    if not os.path.exists(p):
+        return None
+    with open(p, "rb") as f:
+        return f.read()
+
 st.markdown('<div class="header">', unsafe_allow_html=True)
-if os.path.exists("logo.png"):
-    st.image("logo.png", width=150)
+logo = _logo()
+if logo:
+    st.image(logo, width=150)
 else:
     st.warning("⚠️ Logo not found — please upload 'logo.png'")
 st.markdown('</div>', unsafe_allow_html=True)
 
 # ── Wizard Steps ──────────────────────────────────────────────────────────────
-steps = ["Profile", "Labs", "Therapies", "Results"]
+steps = ("Profile", "Labs", "Therapies", "Results")
 if "step" not in st.session_state:
     st.session_state.step = 0
 
@@ -46,174 +81,169 @@ def go_back():
         st.session_state.step -= 1
         logging.info(f"Moved to step {st.session_state.step}")
 
+def _form_nav(save_label):
+    # Back/Next submit the form too, so navigating never drops unsaved inputs
+    nav1, nav2, nav3 = st.columns([1,1,1])
+    with nav1:
+        st.form_submit_button("Back", on_click=go_back, disabled=st.session_state.step==0)
+    with nav2:
+        st.form_submit_button(save_label)
+    with nav3:
+        st.form_submit_button("Next", on_click=go_next)
+
 # Display progress indicator
-cols = st.columns(len(steps))
-for i, label in enumerate(steps):
-    cls = "current" if i==st.session_state.step else ""
-    cols[i].markdown(f'<div class="{"progress"} {cls}">{i+1}. {label}</div>', unsafe_allow_html=True)
+html = '<div class="progress">' + ''.join(
+    f'<div class="{"current" if i==st.session_state.step else ""}">{i+1}. {label}</div>'
+    for i, label in enumerate(steps)) + '</div>'
+st.markdown(html, unsafe_allow_html=True)
 
 # ── Initialize session state defaults ────────────────────────────────────────
-defaults = {
-    'age':60, 'sex':'Male', 'weight':75.0, 'height':170.0,
-    'smoker':False, 'diabetes':False, 'egfr':90,
-    'tc':5.2, 'hdl':1.3, 'ldl0':3.0, 'crp':2.5,
-    'hba1c':7.0, 'tg':1.2,
-    'pre_stat':'None','pre_ez':False,'pre_bemp':False,
-    'new_stat':'None','new_ez':False,'new_bemp':False,
-    'sbp':140
-}
-for k,v in defaults.items():
-    if k not in st.session_state:
-        st.session_state[k] = v
-
-# ── Evidence Mapping ─────────────────────────────────────────────────────────
-TRIALS = {
-    "Atorvastatin 80 mg": ("CTT meta-analysis", "https://pubmed.ncbi.nlm.nih.gov/20167315/"),
-    "Rosuvastatin 20 mg": ("CTT meta-analysis", "https://pubmed.ncbi.nlm.nih.gov/20167315/"),
-    "Ezetimibe 10 mg":     ("IMPROVE-IT",         "https://pubmed.ncbi.nlm.nih.gov/26405142/"),
-    "Bempedoic acid":      ("CLEAR Outcomes",     "https://pubmed.ncbi.nlm.nih.gov/35338941/"),
-    "PCSK9 inhibitor":     ("FOURIER",            "https://pubmed.ncbi.nlm.nih.gov/28436927/"),
-    "Inclisiran":          ("ORION-10",           "https://pubmed.ncbi.nlm.nih.gov/32302303/"),
-    "Icosapent ethyl":     ("REDUCE-IT",          "https://pubmed.ncbi.nlm.nih.gov/31141850/"),
-    "Semaglutide":         ("STEP",               "https://pubmed.ncbi.nlm.nih.gov/34499685/")
-}
+# Re-assign every run: widget-keyed values would otherwise be dropped while
+# their step is not rendered
+st.session_state.update({k:st.session_state.get(k, v) for k,v in DEFAULTS.items()})
 
 # ── Utility & Risk Functions ─────────────────────────────────────────────────
-def calculate_ldl_projection(baseline_ldl, pre_list, new_list):
-    E = {
-        "Atorvastatin 80 mg":0.50, "Rosuvastatin 20 mg":0.55,
-        "Ezetimibe 10 mg":0.20,    "Bempedoic acid":0.18,
-        "PCSK9 inhibitor":0.60,    "Inclisiran":0.55
-    }
-    ldl = baseline_ldl
-    for drug in pre_list + new_list:
-        if drug in E:
-            ldl *= (1 - E[drug])
-    return max(ldl, 0.5)
-
 def estimate_10y_risk(age, sex, sbp, tc, hdl, smoker, diabetes, egfr, crp, vasc):
     sex_v = 1 if sex=="Male" else 0
     sm_v  = 1 if smoker else 0
     dm_v  = 1 if diabetes else 0
-    crp_l = math.log(crp+1)
-    lp = (0.064*age + 0.34*sex_v + 0.02*sbp + 0.25*tc
-         -0.25*hdl + 0.44*sm_v + 0.51*dm_v
-         -0.2*(egfr/10) + 0.25*crp_l + 0.4*vasc)
-    raw=1-0.900**math.exp(lp-5.8)
+    raw = risk_kernel(float(age), sex_v, float(sbp), float(tc), float(hdl),
+                      sm_v, dm_v, float(egfr), float(crp), int(vasc))
     return round(min(raw*100,95.0),1)
 
 def convert_5yr(r10):
     p=min(r10,95.0)/100
-    return round(min((1-(1-p)**0.5)*100,95.0),1)
+    return round(min(five_year_kernel(p)*100,95.0),1)
 
 def estimate_lifetime_risk(age, r10):
     years=max(85-age,0)
     p10=min(r10,95.0)/100
-    annual=1-(1-p10)**(1/10)
-    return round(min((1-(1-annual)**years)*100,95.0),1)
+    return round(min(lifetime_kernel(p10,years)*100,95.0),1)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_report(state_tuple, r5, r10, lifetime):
+    from docx import Document  # deferred: only needed once a report is requested
+    buf = BytesIO()
+    doc = Document()
+    doc.add_heading("CVD Risk Report", level=1)
+    for k,v in state_tuple:
+        doc.add_paragraph(f"{k}: {v}")
+    doc.add_paragraph(f"5‑yr Risk: {r5}%, 10‑yr Risk: {r10}%, Lifetime: {lifetime}")
+    doc.save(buf)
+    return buf.getvalue()
+
+@st.cache_resource(max_entries=256)
+def _risk_fig(r5, r10, rlt):
+    # Shared across sessions: callers must not mutate the returned figure
+    import plotly.graph_objects as go  # deferred: only Step 4 draws a chart
+    fig = go.Figure(go.Bar(
+        x=["5‑yr","10‑yr","Lifetime"],
+        y=[r5, r10, rlt],
+        marker_color=["#f39c12","#e74c3c","#2ecc71"]
+    ))
+    fig.update_layout(yaxis_title="Risk (%)",template="plotly_white")
+    return fig
 
 def fmt_pct(x): return f"{x:.1f}%"
 def fmt_pp(x):  return f"{x:.1f} pp"
 
+# ── Results Panel ─────────────────────────────────────────────────────────────
+# Fragment: SBP updates and report generation rerun only this block
+@st.fragment
+def _results_panel():
+    with st.form("sbp_form"):
+        st.number_input("Current SBP (mmHg)",90,200,key="sbp")
+        nav1, nav2 = st.columns([1,1])
+        with nav1:
+            # Full-app rerun: a fragment rerun alone would not leave Step 4
+            if st.form_submit_button("Back"):
+                go_back()
+                st.rerun()
+        with nav2:
+            st.form_submit_button("Update")
+    r10 = estimate_10y_risk(
+        st.session_state.age, st.session_state.sex, st.session_state.sbp,
+        st.session_state.tc,  st.session_state.hdl,  st.session_state.smoker,
+        st.session_state.diabetes, st.session_state.egfr,
+        st.session_state.crp, sum([st.session_state.pre_stat!="None",st.session_state.pre_ez,st.session_state.pre_bemp])
+    )
+    r5  = convert_5yr(r10)
+    rlt = estimate_lifetime_risk(st.session_state.age, r10)
+    lifetime = "N/A" if st.session_state.age>=85 else fmt_pct(rlt)
+    st.write(f"5‑yr: **{fmt_pct(r5)}**, 10‑yr: **{fmt_pct(r10)}**, Lifetime: **{lifetime}**")
+    fig = _risk_fig(r5, r10, (rlt if st.session_state.age<85 else None))
+    st.plotly_chart(fig,use_container_width=True)
+    arr10 = (r10 - rlt) if st.session_state.age<85 else None
+    rrr10 = round(arr10/r10*100,1) if arr10 else None
+    st.write(f"ARR (10y): **{fmt_pp(arr10) if arr10 else 'N/A'}**, RRR (10y): **{fmt_pct(rrr10) if rrr10 else 'N/A'}**")
+    # Download report button (built lazily, cached per state)
+    if st.button("Generate report"):
+        state = tuple(sorted(st.session_state.items()))
+        st.download_button("Download Report (Word)", build_report(state, r5, r10, lifetime), "report.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
 # ── Render Section ────────────────────────────────────────────────────────────
 if st.session_state.step==0:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Step 1: Patient Profile")
-    st.session_state.age = st.number_input("Age (years)",30,90,st.session_state.age)
-    st.session_state.sex = st.selectbox("Sex",["Male","Female"],index=0 if st.session_state.sex=="Male" else 1)
-    st.session_state.weight = st.number_input("Weight (kg)",40.0,200.0,st.session_state.weight)
-    st.session_state.height = st.number_input("Height (cm)",140.0,210.0,st.session_state.height)
+    with st.form("profile"):
+        st.number_input("Age (years)",30,90,key="age")
+        st.selectbox("Sex",["Male","Female"],key="sex")
+        st.number_input("Weight (kg)",40.0,200.0,key="weight")
+        st.number_input("Height (cm)",140.0,210.0,key="height")
+        st.checkbox("Current smoker",key="smoker")
+        st.checkbox("Diabetes",key="diabetes")
+        st.slider("eGFR (mL/min/1.73 m²)",15,120,key="egfr")
+        _form_nav("Save profile")
     bmi = st.session_state.weight/((st.session_state.height/100)**2)
     st.write(f"**BMI:** {bmi:.1f} kg/m²")
-    st.session_state.smoker = st.checkbox("Current smoker",value=st.session_state.smoker)
-    st.session_state.diabetes = st.checkbox("Diabetes",value=st.session_state.diabetes)
-    st.session_state.egfr = st.slider("eGFR (mL/min/1.73 m²)",15,120,st.session_state.egfr)
     st.markdown('</div>', unsafe_allow_html=True)
 
 elif st.session_state.step==1:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Step 2: Laboratory Results")
-    st.session_state.tc    = st.number_input("Total Cholesterol (mmol/L)",2.0,10.0,st.session_state.tc)
-    st.session_state.hdl   = st.number_input("HDL‑C (mmol/L)",0.5,3.0,st.session_state.hdl)
-    st.session_state.ldl0  = st.number_input("Baseline LDL‑C (mmol/L)",0.5,6.0,st.session_state.ldl0)
-    st.session_state.crp   = st.number_input("hs‑CRP (mg/L)",0.1,20.0,st.session_state.crp)
-    st.session_state.hba1c = st.number_input("HbA₁c (%)",4.0,14.0,st.session_state.hba1c)
-    st.session_state.tg    = st.number_input("Triglycerides (mmol/L)",0.3,5.0,st.session_state.tg)
+    with st.form("labs"):
+        st.number_input("Total Cholesterol (mmol/L)",2.0,10.0,key="tc")
+        st.number_input("HDL‑C (mmol/L)",0.5,3.0,key="hdl")
+        st.number_input("Baseline LDL‑C (mmol/L)",0.5,6.0,key="ldl0")
+        st.number_input("hs‑CRP (mg/L)",0.1,20.0,key="crp")
+        st.number_input("HbA₁c (%)",4.0,14.0,key="hba1c")
+        st.number_input("Triglycerides (mmol/L)",0.3,5.0,key="tg")
+        _form_nav("Save labs")
     st.markdown('</div>', unsafe_allow_html=True)
 
 elif st.session_state.step==2:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Step 3: Therapies")
-    st.session_state.pre_stat = st.selectbox("Pre‑admission Statin",
-        ["None","Atorvastatin 80 mg","Rosuvastatin 20 mg"],index=0)
-    st.session_state.pre_ez   = st.checkbox("Pre‑admission Ezetimibe",value=st.session_state.pre_ez)
-    st.session_state.pre_bemp = st.checkbox("Pre‑admission Bempedoic acid",value=st.session_state.pre_bemp)
+    # No form here: PCSK9/Inclisiran eligibility must follow the live selections
+    st.selectbox("Pre‑admission Statin",STATINS,key="pre_stat")
+    st.checkbox("Pre‑admission Ezetimibe",key="pre_ez")
+    st.checkbox("Pre‑admission Bempedoic acid",key="pre_bemp")
     st.markdown("---", unsafe_allow_html=True)
-    st.session_state.new_stat = st.selectbox("Initiate/Intensify Statin",
-        ["None","Atorvastatin 80 mg","Rosuvastatin 20 mg"],index=0)
-    st.session_state.new_ez   = st.checkbox("Add Ezetimibe",value=st.session_state.new_ez)
-    st.session_state.new_bemp = st.checkbox("Add Bempedoic acid",value=st.session_state.new_bemp)
-    post_ldl = calculate_ldl_projection(
-        st.session_state.ldl0,
-        [st.session_state.pre_stat] + (["Ezetimibe 10 mg"] if st.session_state.pre_ez else []) + (["Bempedoic acid"] if st.session_state.pre_bemp else []),
-        [st.session_state.new_stat] + (["Ezetimibe 10 mg"] if st.session_state.new_ez else []) + (["Bempedoic acid"] if st.session_state.new_bemp else [])
-    )
-    st.session_state.pcsk9      = st.checkbox("PCSK9 inhibitor",disabled=(post_ldl<=1.8),value=st.session_state.pcsk9)  
-    st.session_state.inclisiran = st.checkbox("Inclisiran",    disabled=(post_ldl<=1.8),value=st.session_state.inclisiran)
+    st.selectbox("Initiate/Intensify Statin",STATINS,key="new_stat")
+    st.checkbox("Add Ezetimibe",key="new_ez")
+    st.checkbox("Add Bempedoic acid",key="new_bemp")
+    mask = therapy_mask(st.session_state.pre_stat, st.session_state.pre_ez, st.session_state.pre_bemp,
+                        st.session_state.new_stat, st.session_state.new_ez, st.session_state.new_bemp)
+    post_ldl = calculate_ldl_projection(st.session_state.ldl0, mask)
+    if post_ldl<=1.8:
+        st.session_state.update(pcsk9=False, inclisiran=False)
+    st.checkbox("PCSK9 inhibitor",disabled=(post_ldl<=1.8),key="pcsk9")
+    st.checkbox("Inclisiran",    disabled=(post_ldl<=1.8),key="inclisiran")
     st.markdown('</div>', unsafe_allow_html=True)
 
 elif st.session_state.step==3:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Step 4: Results & Recommendations")
-    st.session_state.sbp = st.number_input("Current SBP (mmHg)",90,200,st.session_state.sbp)
-    r10 = estimate_10y_risk(
-        st.session_state.age, st.session_state.sex, st.session_state.sbp,
-        st.session_state.tc,  st.session_state.hdl,  st.session_state.smoker,
-        st.session_state.diabetes, st.session_state.egfr,
-        st.session_state.crp, sum([st.session_state.pre_stat!="None",st.session_state.pre_ez,st.session_state.pre_bemp])
-    )
-    r5  = convert_5yr(r10)
-    rlt = estimate_lifetime_risk(st.session_state.age, r10)
-    lifetime = "N/A" if st.session_state.age>=85 else fmt_pct(rlt)
-    st.write(f"5‑yr: **{fmt_pct(r5)}**, 10‑yr: **{fmt_pct(r10)}**, Lifetime: **{lifetime}**")
-    fig = go.Figure(go.Bar(
-        x=["5‑yr","10‑yr","Lifetime"],
-        y=[r5, r10, (rlt if st.session_state.age<85 else None)],
-        marker_color=["#f39c12","#e74c3c","#2ecc71"]
-    ))
-    fig.update_layout(yaxis_title="Risk (%)",template="plotly_white")
-    st.plotly_chart(fig,use_container_width=True)
-    arr10 = (r10 - rlt) if st.session_state.age<85 else None
-    rrr10 = round(arr10/r10*100,1) if arr10 else None
-    st.write(f"ARR (10y): **{fmt_pp(arr10) if arr10 else 'N/A'}**, RRR (10y): **{fmt_pct(rrr10) if rrr10 else 'N/A'}**")
-    # Download report button
-    buf = BytesIO()
-    doc = Document()
-    doc.add_heading("CVD Risk Report", level=1)
-    for k,v in st.session_state.items():
-        doc.add_paragraph(f"{k}: {v}")
-    doc.add_paragraph(f"5‑yr Risk: {r5}%, 10‑yr Risk: {r10}%, Lifetime: {lifetime}")
-    doc.save(buf)
-    st.download_button("Download Report (Word)", buf.getvalue(), "report.docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    _results_panel()
     st.markdown('</div>', unsafe_allow_html=True)
 
 # ── Navigation Buttons ─────────────────────────────────────────────────────────
-nav1, nav2, nav3 = st.columns([1,1,1])
-with nav1:
-    if st.button("Back") and st.session_state.step>0:
-        go_back()
-with nav3:
-    if st.button("Next") and st.session_state.step<3:
-        go_next()
-
-st.markdown("---")
-st.markdown("Created by Samuel Panday — 21/04/2025")
-st.markdown("PRIME team, King's College Hospital")
-st.markdown("For informational purposes; not a substitute for clinical advice.")
-"""
-
-# Write to file
-Path("/mnt/data/app_final_wizard.py").write_text(fixed_code)
-
-# Return file path for download
-"/mnt/data/app_final_wizard.py"
+# Form steps navigate through their own submit buttons (see _form_nav)
+if st.session_state.step==2:
+    nav1, nav2, nav3 = st.columns([1,1,1])
+    with nav1:
+        st.button("Back", on_click=go_back)
+    with nav3:
+        st.button("Next", on_click=go_next)
+
+st.markdown(_FOOTER)
@@ -0,0 +1,72 @@
+import math
+from functools import lru_cache
+from types import MappingProxyType
+import numpy as np
+from numba import njit
+
+# ── Numba Kernels ────────────────────────────────────────────────────────────
+# Kept out of the Streamlit script so they compile once per process rather
+# than on every rerun; the app wraps them with coercion, clamping & rounding.
+
+# 0.9**x == exp(x*ln 0.9): saves the pow call in risk_kernel
+_LN09 = math.log(0.900)
+
+# Plain-Python source shared by the JIT kernel and the AOT build (_risk_aot.py)
+def _risk(age, sex_v, sbp, tc, hdl, sm_v, dm_v, egfr, crp, vasc):
+    lp = (0.064*age + 0.34*sex_v + 0.02*sbp + 0.25*tc
+         -0.25*hdl + 0.44*sm_v + 0.51*dm_v
+         -0.2*(egfr/10) + 0.25*math.log(crp+1) + 0.4*vasc)
+    return 1.0 - math.exp(_LN09 * math.exp(lp-5.8))
+
+risk_kernel = njit(cache=True, fastmath=True)(_risk)
+
+@njit(cache=True, fastmath=True)
+def five_year_kernel(p10):
+    return 1 - (1-p10)**0.5
+
+@njit(cache=True, fastmath=True)
+def lifetime_kernel(p10, years):
+    annual = 1 - (1-p10)**(1/10)
+    return 1 - (1-annual)**years
+
+@njit(cache=True, fastmath=True)
+def ldl_kernel(baseline_ldl, keep):
+    return baseline_ldl * np.prod(keep)
+
+# Warm-up: pay the JIT (or cache load) cost once at import
+five_year_kernel(0.1)
+lifetime_kernel(0.1, 25)
+ldl_kernel(3.0, np.ones(1, dtype=np.float64))
+
+# Prefer the precompiled extension when it has been built; otherwise JIT
+try:
+    from risk_aot import risk10 as risk_kernel
+except ImportError:
+    risk_kernel(60.0, 1, 140.0, 5.2, 1.3, 0, 0, 90.0, 2.5, 0)
+
+
+# ── LDL Projection ───────────────────────────────────────────────────────────
+# LDL-C lowering efficacy per drug; _KEEP holds (1 - efficacy) indexed via _DRUG_IDX
+_E = MappingProxyType({
+    "Atorvastatin 80 mg":0.50, "Rosuvastatin 20 mg":0.55,
+    "Ezetimibe 10 mg":0.20,    "Bempedoic acid":0.18,
+    "PCSK9 inhibitor":0.60,    "Inclisiran":0.55
+})
+_DRUG_IDX = MappingProxyType({d:i for i,d in enumerate(_E)})
+_KEEP = 1 - np.fromiter(_E.values(), dtype=np.float64)
+
+# Step-3 therapy mask, LSB first: bits 0-1 pre-admission statin (one-hot from
+# its STATINS index), 2 ezetimibe, 3 bempedoic acid; bits 4-7 the same for new therapy
+STATINS = ("None", "Atorvastatin 80 mg", "Rosuvastatin 20 mg")
+_MASK_KEEP = _KEEP[[_DRUG_IDX[d] for d in STATINS[1:] + ("Ezetimibe 10 mg", "Bempedoic acid")] * 2]
+
+def therapy_mask(pre_stat, pre_ez, pre_bemp, new_stat, new_ez, new_bemp):
+    return (STATINS.index(pre_stat) | (int(pre_ez)<<2) | (int(pre_bemp)<<3)
+            | (STATINS.index(new_stat)<<4) | (int(new_ez)<<6) | (int(new_bemp)<<7))
+
+# Memoized here rather than in the app: the Streamlit script is re-executed
+# on every rerun, which would discard a module-level lru_cache each time.
+@lru_cache(maxsize=256)
+def calculate_ldl_projection(baseline_ldl, mask):
+    bits = np.unpackbits(np.uint8(mask), bitorder="little")
+    return max(ldl_kernel(float(baseline_ldl), _MASK_KEEP[bits==1]), 0.5)